@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
 import io
-import plotly.express as px
+from typing import Optional, Union
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 
 # Page Config
 st.set_page_config(page_title="GSC Analyzer Pro - Pravesh Patel", page_icon="🔍", layout="wide")
@@ -17,6 +21,316 @@ st.markdown("""
 st.title("🔍 Google Search Console Analyzer Pro")
 st.caption("Developed by Pravesh Patel")
 
+# =============================
+# 📥 Cached Loaders
+# =============================
+NUMERIC_COLS = ["clicks", "impressions", "ctr", "position"]
+# Upload-scoped caches are keyed on UploadedFile.file_id, which is new for every upload and never hit again
+# once its session ends. The TTL is the main bound: every entry is dropped an hour after it was built (an
+# upload still open then is rebuilt once on its next rerun). max_entries is only a backstop against bursts,
+# sized per helper from what one upload stores so concurrent uploads don't evict each other.
+UPLOAD_CACHE_TTL = "1h"
+# load_csv, load_xlsx, segment_queries, lowered_queries: one entry per upload
+FRAME_CACHE_ENTRIES = 32
+# to_csv_bytes, to_parquet_bytes: up to three small export blobs per upload
+EXPORT_CACHE_ENTRIES = 128
+# max_impressions: one int per upload
+SCALAR_CACHE_ENTRIES = 1024
+
+
+def _norm_cols(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_", regex=False)
+    return df
+
+
+def _to_numeric(s: pd.Series) -> pd.Series:
+    # Columns the reader already parsed as numbers skip the string pass entirely
+    if pd.api.types.is_numeric_dtype(s):
+        return s
+    # "1,234" / "3.45%" -> float: one Arrow regex-replace pass; unparseable cells become NaN
+    stripped = s.astype("string[pyarrow]").str.replace(r"[,%]", "", regex=True)
+    parsed = pd.to_numeric(stripped, errors="coerce")
+    return pd.Series(parsed.to_numpy(dtype=np.float64, na_value=np.nan), index=s.index)
+
+
+def _downcast(df: pd.DataFrame) -> pd.DataFrame:
+    # GSC counts are non-negative integers and CTR/position need no more than float32
+    for col in ("clicks", "impressions"):
+        df[col] = pd.to_numeric(df[col], downcast="unsigned")
+    df[["ctr", "position"]] = df[["ctr", "position"]].astype(np.float32)
+    return df
+
+
+def _clean_sheet(df: pd.DataFrame, top_col: str, id_col: str, fraction_ctr: bool = False) -> pd.DataFrame:
+    # Shared by the CSV upload and every Excel sheet; mutates and returns df
+    _norm_cols(df)
+    df.rename(columns={top_col: id_col}, inplace=True)
+    # Excel stores percent-formatted CTR cells as fractions (0.034); text cells ("3.4%") are already percentages
+    ctr = df["ctr"]
+    pct_text = not pd.api.types.is_numeric_dtype(ctr) and ctr.astype("string[pyarrow]").str.contains("%", regex=False).any()
+    for col in NUMERIC_COLS:
+        df[col] = _to_numeric(df[col])
+    if fraction_ctr and not pct_text and df["ctr"].max() <= 1:
+        df["ctr"] *= 100
+    # Fully blank rows (e.g. trailing spreadsheet rows) always lack impressions, so the five-column
+    # dropna only runs when that single-column check finds a gap
+    if df["impressions"].isna().any():
+        df.dropna(subset=[id_col, *NUMERIC_COLS], how="all", inplace=True)
+    df[id_col] = df[id_col].astype("string[pyarrow]")
+    return _downcast(df)
+
+
+# The loaders are keyed on the upload's file_id rather than its bytes, so a cache hit doesn't rehash the
+# whole file on every rerun; the unhashed _upload is only read on a miss
+@st.cache_data(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def load_csv(upload_key: str, _upload: io.BytesIO) -> pd.DataFrame:
+    # Arrow's multithreaded reader parses the bytes directly; the query column is pinned to text so
+    # purely numeric queries aren't inferred as numbers. Numeric columns are inferred and cleaned by _to_numeric.
+    # Empty cells stay null (not "") so blank trailing rows are still dropped by _clean_sheet.
+    _upload.seek(0)
+    convert_options = pacsv.ConvertOptions(column_types={"Top queries": pa.string()}, strings_can_be_null=True)
+    table = pacsv.read_csv(_upload, convert_options=convert_options)
+    # Arrow buffers are released column by column as pandas takes them over, so the file isn't held twice;
+    # table must not be used afterwards
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    return _clean_sheet(df, "top_queries", "query")
+
+
+@st.cache_data(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def load_xlsx(upload_key: str, _upload: io.BytesIO) -> dict[str, pd.DataFrame]:
+    _upload.seek(0)
+    try:
+        book = pd.ExcelFile(_upload, engine="calamine")
+    except ImportError:
+        # python-calamine not installed, use the (much slower) openpyxl reader
+        book = pd.ExcelFile(_upload)
+
+    # Only the sheets the dashboard uses are parsed (GSC exports also carry Dates, Devices, Filters, ...),
+    # which also keeps the cached result small since st.cache_data copies it on every hit
+    wanted = (("Queries", "top_queries", "query"), ("Pages", "top_pages", "page"), ("Countries", "top_countries", "country"))
+    with book:
+        return {
+            name: _clean_sheet(book.parse(name, thousands=","), top_col, id_col, fraction_ctr=True)
+            for name, top_col, id_col in wanted
+            if name in book.sheet_names
+        }
+
+
+# =============================
+# 🧮 Query Pipeline
+# =============================
+# Scatter plots are thinned to at most this many points before being sent to the browser
+MAX_SCATTER_POINTS = 5000
+# Rows shown in each alert expander
+ALERT_PREVIEW_ROWS = 20
+
+
+def _fold_case(values: Union[pa.Array, pa.Scalar]) -> Union[pa.Array, pa.Scalar]:
+    # Arrow utf8_lower, plus final sigma folded to σ so "ΣΊΣΥΦΟΣ" and "σίσυφος" match as case=False did
+    return pc.replace_substring(pc.utf8_lower(values), "ς", "σ")
+
+
+def filter_queries(df: pd.DataFrame, lowered: pd.Series, min_impr: int, keyword_filter: str) -> pd.DataFrame:
+    # Both conditions are combined into one mask so at most a single filtered frame is allocated.
+    # lowered is the query column from lowered_queries; the keyword is folded the same way (_fold_case)
+    # so the case-insensitive match agrees on characters like final sigma or dotted İ.
+    mask = None
+    if min_impr > 0:
+        mask = df["impressions"].to_numpy() >= min_impr
+    if keyword_filter:
+        needle = _fold_case(pa.scalar(keyword_filter)).as_py()
+        matches = lowered.str.contains(needle, na=False, regex=False).to_numpy(dtype=bool)
+        mask = matches if mask is None else mask & matches
+    return df if mask is None else df.iloc[np.flatnonzero(mask)]
+
+
+def _wmean(vals: np.ndarray, weights: np.ndarray, total: float) -> float:
+    if not total:
+        return 0.0
+    # Accumulate in float64 even though the columns are stored as float32/uint
+    acc = np.einsum("i,i->", vals, weights, dtype=np.float64)
+    if np.isnan(acc):
+        # Skip NaN cells the way pandas' sum() does
+        acc = np.nansum(vals.astype(np.float64) * weights)
+    return float(acc) / total
+
+
+def kpi_totals(df: pd.DataFrame) -> tuple[float, float, float, float]:
+    # (total clicks, total impressions, impression-weighted CTR, impression-weighted position)
+    total_impr = df["impressions"].sum()
+    impr = df["impressions"].to_numpy()
+    avg_ctr = _wmean(df["ctr"].to_numpy(), impr, total_impr)
+    avg_pos = _wmean(df["position"].to_numpy(), impr, total_impr)
+    return df["clicks"].sum(), total_impr, avg_ctr, avg_pos
+
+
+def thin_for_scatter(df: pd.DataFrame) -> pd.DataFrame:
+    if len(df) <= MAX_SCATTER_POINTS:
+        return df
+    stride = -(-len(df) // MAX_SCATTER_POINTS)
+    return df.iloc[::stride]
+
+
+def ols_line(x: np.ndarray, y: np.ndarray) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    # Closed-form simple linear regression; returns the fitted line's endpoints
+    ok = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[ok], y[ok]
+    if len(x) < 2:
+        return None
+    xm, ym = x.mean(), y.mean()
+    dx = x - xm
+    sxx = dx @ dx
+    if not sxx:
+        return None
+    slope = (dx @ (y - ym)) / sxx
+    xs = np.array([x.min(), x.max()])
+    return xs, slope * xs + (ym - slope * xm)
+
+
+def opportunity_keywords(df: pd.DataFrame) -> pd.DataFrame:
+    pos, ctr = df["position"].to_numpy(), df["ctr"].to_numpy()
+    return df.iloc[np.flatnonzero((pos >= 5) & (pos <= 15) & (ctr < 5))]
+
+
+@st.cache_resource(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def lowered_queries(upload_key: str, _df: pd.DataFrame) -> pd.Series:
+    # Arrow's case-insensitive match goes through its regex engine; matching a folded keyword against a
+    # column folded once per upload uses the plain substring kernel instead. cache_resource avoids copying it per rerun.
+    return pd.Series(pd.arrays.ArrowStringArray(_fold_case(pa.array(_df["query"]))), index=_df.index)
+
+
+@st.cache_data(show_spinner=False, max_entries=SCALAR_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def max_impressions(upload_key: str, _df: pd.DataFrame) -> int:
+    # Slider bound; only changes with the upload
+    return int(_df["impressions"].max())
+
+
+def _top_first(idx: np.ndarray, vals: np.ndarray, k: int = ALERT_PREVIEW_ROWS) -> np.ndarray:
+    # Reorder idx so its first k entries are the rows with the largest vals (descending); the rest stay unordered
+    if len(idx) > k:
+        idx = idx[np.argpartition(vals[idx], len(idx) - k)][::-1]
+    head = idx[:k]
+    return np.concatenate([head[np.argsort(vals[head], kind="stable")[::-1]], idx[k:]])
+
+
+@st.cache_data(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def segment_queries(upload_key: str, _df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray, pd.DataFrame]:
+    # All alert/opportunity slices are derived from the unfiltered frame in one place: (critical, warnings, wins, opp).
+    # Alerts are returned as row positions so only the previewed rows are ever copied out of df.
+    # They depend only on the upload, so the cache is keyed on upload_key and _df itself is never hashed.
+    df = _df
+    clicks, impr, ctr, pos = (df[c].to_numpy() for c in ("clicks", "impressions", "ctr", "position"))
+    hi_impr = impr > 1000
+    critical = _top_first(np.flatnonzero(hi_impr & (ctr < 1.0)), impr)
+    warnings = _top_first(np.flatnonzero(hi_impr & (clicks < 10)), impr)
+    wins = _top_first(np.flatnonzero((ctr > 10.0) & (pos > 10)), impr)
+    return critical, warnings, wins, opportunity_keywords(df)
+
+
+def filtered_queries(df: pd.DataFrame, upload_key: str, widget_key: str, default_min_impr: int) -> pd.DataFrame:
+    # Shared filter controls; widget_key keeps the two tabs' sliders/inputs from colliding
+    max_impr = max_impressions(upload_key, df)
+    min_impr = st.slider("Minimum Impressions", 0, max_impr, min(default_min_impr, max_impr), key=f"{widget_key}_min_impr")
+    keyword_filter = st.text_input("Filter by Query (Optional)", "", key=f"{widget_key}_keyword")
+    return filter_queries(df, lowered_queries(upload_key, df), min_impr, keyword_filter)
+
+
+def opportunity_table(slot: str, file_id: str, opp: pd.DataFrame) -> pa.Table:
+    # The full opportunities table only changes with the upload, so keep its sorted Arrow form per tab/file
+    tables = st.session_state.setdefault("opportunity_tables", {})
+    if tables.get(slot, (None,))[0] != file_id:
+        sorted_opp = opp.sort_values(by="impressions", ascending=False)
+        tables[slot] = (file_id, pa.Table.from_pandas(sorted_opp, preserve_index=False))
+    return tables[slot][1]
+
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def to_csv_bytes(export_key: str, _df: pd.DataFrame) -> bytes:
+    # export_key identifies the upload + table, which avoids hashing the whole frame on every rerun
+    return _df.to_csv(index=False).encode("utf-8")
+
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def to_parquet_bytes(export_key: str, _df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    _df.to_parquet(buf, index=False, compression="snappy")
+    return buf.getvalue()
+
+
+# =============================
+# 🧩 Filtered Sections
+# =============================
+# st.fragment: moving the slider or typing a keyword reruns only these functions
+@st.fragment
+def csv_filtered_section(df: pd.DataFrame, upload_key: str) -> None:
+    filtered = filtered_queries(df, upload_key, "csv", default_min_impr=0)
+
+    st.subheader("📊 Overall Performance (Filtered)")
+    total_clicks, total_impr, avg_ctr, avg_pos = kpi_totals(filtered)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total", f"{total_clicks:,.0f}")
+    col2.metric("Clicks", f"{total_impr:,.0f}")
+    col3.metric("Avg. CTR", f"{avg_ctr:.2f}%")
+    col4.metric("Avg. Position", f"{avg_pos:.2f}")
+
+    st.subheader("📈 CTR vs Position Trend")
+    # Plotly is only needed once a CSV is loaded; importing it here keeps the landing page cold start fast
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    fig = px.scatter(thin_for_scatter(filtered), x="position", y="ctr", hover_data=["query"], render_mode="webgl")
+    trend = ols_line(filtered["position"].to_numpy(), filtered["ctr"].to_numpy())
+    if trend is not None:
+        fig.add_trace(go.Scatter(x=trend[0], y=trend[1], mode="lines", name="OLS trendline"))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("🔝 Top Queries by Clicks")
+    st.dataframe(filtered.nlargest(10, "clicks"), use_container_width=True)
+
+
+@st.fragment
+def excel_filtered_section(queries_df: pd.DataFrame, upload_key: str, segments: tuple) -> None:
+    # segments is the segment_queries() result for the unfiltered sheet; fragment reruns reuse it as-is
+    critical, warnings, wins, opp = segments
+    filtered = filtered_queries(queries_df, upload_key, "excel", default_min_impr=100)
+
+    st.subheader("📊 Performance Metrics")
+    total_clicks, total_impr, avg_ctr, avg_pos = kpi_totals(filtered)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total Clicks", f"{total_clicks:,.0f}")
+    col2.metric("Total Impressions", f"{total_impr:,.0f}")
+    col3.metric("Avg. CTR", f"{avg_ctr:.2f}%")
+    col4.metric("Avg. Position", f"{avg_pos:.2f}")
+
+    st.subheader("🔔 Alerts Dashboard")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("🔴 Critical", f"{len(critical)}")
+    col2.metric("🟠 Warnings", f"{len(warnings)}")
+    col3.metric("🟢 Wins", f"{len(wins)}")
+
+    with st.expander("🔴 View Critical Issues"):
+        st.dataframe(queries_df.iloc[critical[:ALERT_PREVIEW_ROWS]], use_container_width=True)
+    with st.expander("🟠 View Warning Keywords"):
+        st.dataframe(queries_df.iloc[warnings[:ALERT_PREVIEW_ROWS]], use_container_width=True)
+    with st.expander("🟢 View Wins"):
+        st.dataframe(queries_df.iloc[wins[:ALERT_PREVIEW_ROWS]], use_container_width=True)
+
+    st.subheader("🧠 AI-Powered Recommendations")
+    insights = []
+    if len(critical): insights.append(f"Improve meta for **{len(critical)}** low CTR keywords with high impressions.")
+    if len(warnings): insights.append(f"Check **{len(warnings)}** keywords gaining impressions but low clicks.")
+    if len(wins): insights.append(f"Boost **{len(wins)}** high CTR keywords ranking low using internal linking.")
+    if len(opp): insights.append(f"You have **{len(opp)} opportunity keywords** between position 5–15 and CTR < 5%.")
+    for i in insights:
+        st.markdown(f"- {i}")
+    if not insights:
+        st.info("No significant issues or opportunities found in this dataset.")
+
+    st.subheader("🔝 Top Queries by Clicks")
+    st.dataframe(filtered.nlargest(10, "clicks"), use_container_width=True)
+
 # Tabs
 tab1, tab2 = st.tabs(["📄 CSV Analyzer", "📊 Excel Analyzer"])
 
@@ -28,47 +342,16 @@ with tab1:
         csv_file = st.file_uploader("Upload CSV File (Performance > Queries)", type=["csv"])
 
     if csv_file:
-        raw = csv_file.read().decode("utf-8")
-        df = pd.read_csv(io.StringIO(raw))
-        df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-        df.rename(columns={"top_queries": "query"}, inplace=True)
-
-        for col in ["clicks", "impressions", "position"]:
-            df[col] = pd.to_numeric(df[col].astype(str).str.replace(",", ""), errors='coerce')
-        df["ctr"] = pd.to_numeric(df["ctr"].astype(str).str.replace("%", "").str.replace(",", ""), errors='coerce')
-        df.dropna(subset=["query", "clicks", "impressions", "ctr", "position"], how="all", inplace=True)
-
-        min_impr = st.slider("Minimum Impressions", 0, int(df["impressions"].max()), 0)
-        keyword_filter = st.text_input("Filter by Query (Optional)", "")
-
-        filtered = df[df["impressions"] >= min_impr]
-        if keyword_filter:
-            filtered = filtered[filtered["query"].str.contains(keyword_filter, case=False, na=False)]
-
-        st.subheader("📊 Overall Performance (Filtered)")
-        total_clicks = filtered["clicks"].sum()
-        total_impr = filtered["impressions"].sum()
-        avg_ctr = (filtered["ctr"] * filtered["impressions"]).sum() / total_impr if total_impr else 0
-        avg_pos = (filtered["position"] * filtered["impressions"]).sum() / total_impr if total_impr else 0
-
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Total", f"{total_clicks:,.0f}")
-        col2.metric("Clicks", f"{total_impr:,.0f}")
-        col3.metric("Avg. CTR", f"{avg_ctr:.2f}%")
-        col4.metric("Avg. Position", f"{avg_pos:.2f}")
-
-        st.subheader("📈 CTR vs Position Trend")
-        fig = px.scatter(filtered, x="position", y="ctr", hover_data=["query"], trendline="ols")
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.subheader("🔝 Top Queries by Clicks")
-        st.dataframe(filtered.sort_values(by="clicks", ascending=False).head(10), use_container_width=True)
+        df = load_csv(csv_file.file_id, csv_file)
+
+        csv_filtered_section(df, csv_file.file_id)
 
         st.subheader("💡 Opportunity Keywords (Position 5–15, CTR < 5%)")
-        opp = df[(df["position"].between(5, 15)) & (df["ctr"] < 5)]
+        _, _, _, opp = segment_queries(csv_file.file_id, df)
         st.markdown(f"**Total Opportunities**: {len(opp)}")
-        st.dataframe(opp.sort_values(by="impressions", ascending=False), use_container_width=True)
-        st.download_button("📥 Download Opportunities as CSV", opp.to_csv(index=False), file_name="csv_opportunity_keywords.csv", mime="text/csv")
+        st.dataframe(opportunity_table("csv", csv_file.file_id, opp), use_container_width=True)
+        st.download_button("📥 Download Opportunities as CSV", to_csv_bytes(f"{csv_file.file_id}/opportunities", opp), file_name="csv_opportunity_keywords.csv", mime="text/csv")
+        st.download_button("📥 Download Opportunities as Parquet", to_parquet_bytes(f"{csv_file.file_id}/opportunities", opp), file_name="csv_opportunity_keywords.parquet", mime="application/vnd.apache.parquet")
 
 # =============================
 # 📊 Excel Analyzer
@@ -78,102 +361,24 @@ with tab2:
         excel_file = st.file_uploader("Upload Excel File (.xlsx)", type=["xlsx"])
 
     if excel_file:
-        sheets = pd.read_excel(excel_file, sheet_name=None)
+        sheets = load_xlsx(excel_file.file_id, excel_file)
         queries_df = sheets.get("Queries")
         if queries_df is not None:
-            queries_df.columns = [c.strip().lower().replace(" ", "_") for c in queries_df.columns]
-            queries_df.rename(columns={"top_queries": "query"}, inplace=True)
-
-            for col in ["clicks", "impressions", "position"]:
-                queries_df[col] = pd.to_numeric(queries_df[col].astype(str).str.replace(",", ""), errors='coerce')
-            queries_df["ctr"] = pd.to_numeric(queries_df["ctr"].astype(str).str.replace("%", "").str.replace(",", ""), errors='coerce')
-            if queries_df["ctr"].max() <= 1:
-                queries_df["ctr"] *= 100
-
-            queries_df.dropna(subset=["query", "clicks", "impressions", "ctr", "position"], how="all", inplace=True)
-
-            min_impr = st.slider("Minimum Impressions", 0, int(queries_df["impressions"].max()), 100)
-            keyword_filter = st.text_input("Filter by Query (Optional)", "")
-
-            filtered = queries_df[queries_df["impressions"] >= min_impr]
-            if keyword_filter:
-                filtered = filtered[filtered["query"].str.contains(keyword_filter, case=False, na=False)]
-
-            st.subheader("📊 Performance Metrics")
-            total_clicks = filtered["clicks"].sum()
-            total_impr = filtered["impressions"].sum()
-            avg_ctr = (filtered["ctr"] * filtered["impressions"]).sum() / total_impr if total_impr else 0
-            avg_pos = (filtered["position"] * filtered["impressions"]).sum() / total_impr if total_impr else 0
-
-            col1, col2, col3, col4 = st.columns(4)
-            col1.metric("Total Clicks", f"{total_clicks:,.0f}")
-            col2.metric("Total Impressions", f"{total_impr:,.0f}")
-            col3.metric("Avg. CTR", f"{avg_ctr:.2f}%")
-            col4.metric("Avg. Position", f"{avg_pos:.2f}")
-
-            st.subheader("🔔 Alerts Dashboard")
-            critical = queries_df[(queries_df["ctr"] < 1.0) & (queries_df["impressions"] > 1000)]
-            warnings = queries_df[(queries_df["impressions"] > 1000) & (queries_df["clicks"] < 10)]
-            wins = queries_df[(queries_df["ctr"] > 10.0) & (queries_df["position"] > 10)]
-
-            col1, col2, col3 = st.columns(3)
-            col1.metric("🔴 Critical", f"{len(critical)}")
-            col2.metric("🟠 Warnings", f"{len(warnings)}")
-            col3.metric("🟢 Wins", f"{len(wins)}")
-
-            with st.expander("🔴 View Critical Issues"):
-                st.dataframe(critical.head(20), use_container_width=True)
-            with st.expander("🟠 View Warning Keywords"):
-                st.dataframe(warnings.head(20), use_container_width=True)
-            with st.expander("🟢 View Wins"):
-                st.dataframe(wins.head(20), use_container_width=True)
-
-            st.subheader("🧠 AI-Powered Recommendations")
-            insights = []
-            if len(critical): insights.append(f"Improve meta for **{len(critical)}** low CTR keywords with high impressions.")
-            if len(warnings): insights.append(f"Check **{len(warnings)}** keywords gaining impressions but low clicks.")
-            if len(wins): insights.append(f"Boost **{len(wins)}** high CTR keywords ranking low using internal linking.")
-            opp = queries_df[(queries_df["position"].between(5, 15)) & (queries_df["ctr"] < 5)]
-            if len(opp): insights.append(f"You have **{len(opp)} opportunity keywords** between position 5–15 and CTR < 5%.")
-            for i in insights:
-                st.markdown(f"- {i}")
-            if not insights:
-                st.info("No significant issues or opportunities found in this dataset.")
-
-            st.subheader("🔝 Top Queries by Clicks")
-            st.dataframe(filtered.sort_values(by="clicks", ascending=False).head(10), use_container_width=True)
+            segments = segment_queries(excel_file.file_id, queries_df)
+            excel_filtered_section(queries_df, excel_file.file_id, segments)
 
+            _, _, _, opp = segments
             st.subheader("💡 Opportunity Keywords (Position 5–15, CTR < 5%)")
             st.markdown(f"**Total Opportunities**: {len(opp)}")
-            st.dataframe(opp.sort_values(by="impressions", ascending=False), use_container_width=True)
-            st.download_button("📥 Download Opportunities as CSV", opp.to_csv(index=False), file_name="excel_opportunity_keywords.csv", mime="text/csv")
-
-        # ========== PAGES SHEET ==========
-        pages_df = sheets.get("Pages")
-        if pages_df is not None:
-            st.subheader("🌐 Top Pages Performance")
-            pages_df.columns = [c.strip().lower().replace(" ", "_") for c in pages_df.columns]
-            pages_df.rename(columns={"top_pages": "page"}, inplace=True)
-            for col in ["clicks", "impressions", "position"]:
-                pages_df[col] = pd.to_numeric(pages_df[col].astype(str).str.replace(",", ""), errors='coerce')
-            pages_df["ctr"] = pd.to_numeric(pages_df["ctr"].astype(str).str.replace("%", "").str.replace(",", ""), errors='coerce')
-            if pages_df["ctr"].max() <= 1:
-                pages_df["ctr"] *= 100
-            pages_df.dropna(subset=["page", "clicks", "impressions", "ctr", "position"], how="all", inplace=True)
-            st.dataframe(pages_df.sort_values(by="clicks", ascending=False).head(10), use_container_width=True)
-            st.download_button("📥 Download Pages Data", pages_df.to_csv(index=False), file_name="pages_data.csv", mime="text/csv")
-
-        # ========== COUNTRIES SHEET ==========
-        countries_df = sheets.get("Countries")
-        if countries_df is not None:
-            st.subheader("🌍 Top Countries Performance")
-            countries_df.columns = [c.strip().lower().replace(" ", "_") for c in countries_df.columns]
-            countries_df.rename(columns={"top_countries": "country"}, inplace=True)
-            for col in ["clicks", "impressions", "position"]:
-                countries_df[col] = pd.to_numeric(countries_df[col].astype(str).str.replace(",", ""), errors='coerce')
-            countries_df["ctr"] = pd.to_numeric(countries_df["ctr"].astype(str).str.replace("%", "").str.replace(",", ""), errors='coerce')
-            if countries_df["ctr"].max() <= 1:
-                countries_df["ctr"] *= 100
-            countries_df.dropna(subset=["country", "clicks", "impressions", "ctr", "position"], how="all", inplace=True)
-            st.dataframe(countries_df.sort_values(by="clicks", ascending=False).head(10), use_container_width=True)
-            st.download_button("📥 Download Countries Data", countries_df.to_csv(index=False), file_name="countries_data.csv", mime="text/csv")
+            st.dataframe(opportunity_table("excel", excel_file.file_id, opp), use_container_width=True)
+            st.download_button("📥 Download Opportunities as CSV", to_csv_bytes(f"{excel_file.file_id}/opportunities", opp), file_name="excel_opportunity_keywords.csv", mime="text/csv")
+            st.download_button("📥 Download Opportunities as Parquet", to_parquet_bytes(f"{excel_file.file_id}/opportunities", opp), file_name="excel_opportunity_keywords.parquet", mime="application/vnd.apache.parquet")
+
+        # ========== PAGES & COUNTRIES SHEETS ==========
+        for sheet_name, title in (("Pages", "🌐 Top Pages Performance"), ("Countries", "🌍 Top Countries Performance")):
+            sheet_df = sheets.get(sheet_name)
+            if sheet_df is not None:
+                slug = sheet_name.lower()
+                st.subheader(title)
+                st.dataframe(sheet_df.nlargest(10, "clicks"), use_container_width=True)
+                st.download_button(f"📥 Download {sheet_name} Data", to_csv_bytes(f"{excel_file.file_id}/{slug}", sheet_df), file_name=f"{slug}_data.csv", mime="text/csv")